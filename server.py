@@ -1,29 +1,77 @@
 #!/usr/bin/env python3
-import socket
+import asyncio
+import atexit
+import collections
 import struct
-import threading
+import sys
 import time
-import datetime
 import enum
+import logging
+import logging.handlers
 import os
+import queue
 import signal
+import socket
+import threading
+import zlib
 
-LOG_FILE = "messages.log"
-LOG_ENTRIES = []
-log_lock = threading.Lock()
+try:
+    import uvloop  # optional: libuv based event loop, a faster drop-in for asyncio's default loop
+except ImportError:
+    uvloop = None
+
+DEBUG = bool(os.environ.get("DEBUG"))  # DEBUG=1 python3 server.py logs per message tracing
 
-clients = []   # list of (socket, username, ip)
-clients_lock = threading.Lock()
+log = logging.getLogger("mycord")
+MESSAGE = logging.INFO + 5  # level for the chat traffic itself, shows up as [MESSAGE]
+logging.addLevelName(MESSAGE, "MESSAGE")
+
+# Shared state is owned by the event loop thread (main fills the history before the loop starts).
+# Other threads only ever receive data through a queue.Queue, so nothing here needs a lock or a copy.
+LOG_FILE = "messages.log"
+LOG_ENTRIES = collections.deque(maxlen=10_000)  # recent entries of every type, kept for debugging
+RECENT_SENDS = collections.deque(maxlen=25)  # (entry, packed MESSAGE_RECV frame) history replayed to every new login
+LOG_QUEUE = queue.Queue()  # entries waiting for log_writer, None stops it
+LOG_BATCH_SIZE = 256
+LOG_SYNC_INTERVAL = 5  # seconds the log file may lag behind before it is flushed and fsynced
+
+clients = {}   # writer -> ClientState
+client_tasks = set()  # handler tasks, cancelled on shutdown
 running = True
-server_socket = None  # Global reference to server socket for signal handlers
+
+# A client that falls this far behind on broadcasts is dropped instead of buffering without bound
+MAX_CLIENT_BACKLOG = 256 * 1024
+CLIENT_SNDBUF = 1 << 20  # kernel send buffer per client, room for broadcast bursts before the transport has to buffer
+CLIENT_TIMEOUT = 15 * 60  # seconds without a message before a client is disconnected
+IDLE_CHECK_INTERVAL = 30  # seconds between sweeps for idle clients
+
+
+def setup_logging():
+    """
+    Log to stdout through a queue: the event loop only enqueues records and a
+    QueueListener thread does the (blocking) writes
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+    record_queue = queue.Queue()
+    listener = logging.handlers.QueueListener(record_queue, handler)
+    log.addHandler(logging.handlers.QueueHandler(record_queue))
+    log.setLevel(logging.DEBUG if DEBUG else logging.INFO)
+    log.propagate = False
+    listener.start()
+    # stop() flushes the records that are still queued
+    atexit.register(listener.stop)
+
+
+PRINTABLE_ASCII = bytes(range(0x20, 0x7f))
 
 
-def is_ascii(s):
+def is_printable_ascii(raw: bytes):
     """
-    Python 3.6 compatible replacement for str.isascii() (added in Python 3.7)
-    Checks if all characters in the string are ASCII (ord < 128)
+    Checks if all bytes are printable ASCII (0x20 - 0x7e)
+    bytes.translate deletes the allowed bytes in C, anything left over is not allowed
     """
-    return all(ord(c) < 128 for c in s)
+    return not raw.translate(None, PRINTABLE_ASCII)
 
 
 class LogEntry:
@@ -76,7 +124,11 @@ class Message:
     USERNAME_LEN = 32
     MESSAGE_LEN = 1024
     MSG_FMT = "!II32s1024s"   # type, timestamp, username, message
-    MSG_SIZE = struct.calcsize(MSG_FMT)
+    MSG_STRUCT = struct.Struct(MSG_FMT)  # compiled once, struct.pack would look the format up on every call
+    MSG_SIZE = MSG_STRUCT.size
+    PREFIX_STRUCT = struct.Struct("!II")  # type, timestamp
+    USERNAME_OFFSET = PREFIX_STRUCT.size
+    MESSAGE_OFFSET = USERNAME_OFFSET + USERNAME_LEN
 
     message_type: int
     username: str
@@ -90,67 +142,195 @@ class Message:
         self.timestamp = timestamp or int(time.time())
     
     def pack_message(self):
+        # Truncate to leave room for the terminator, the "32s"/"1024s" fields null pad the rest
         uname_bytes = self.username.encode("utf-8")[:self.USERNAME_LEN-1]
-        uname_bytes = uname_bytes + b"\x00" * (self.USERNAME_LEN - len(uname_bytes))  # Null pad
         msg_bytes = self.message.encode("utf-8")[:self.MESSAGE_LEN-1]
-        msg_bytes = msg_bytes + b"\x00" * (self.MESSAGE_LEN - len(msg_bytes))  # Null pad
-        return struct.pack(self.MSG_FMT, self.message_type, self.timestamp, uname_bytes, msg_bytes)
+        return self.MSG_STRUCT.pack(self.message_type, self.timestamp, uname_bytes, msg_bytes)
+
+    @staticmethod
+    def unpack_header(data):
+        """
+        Split a frame into (type, timestamp, username, message) without decoding anything
+        The username and message are the raw bytes up to their null terminator, sliced straight out of data
+        """
+        if len(data) != Message.MSG_SIZE:
+            raise ValueError(f"Invalid frame size: {len(data)}")
+        msg_type, ts = Message.PREFIX_STRUCT.unpack_from(data)
+        uname_end = data.find(b"\x00", Message.USERNAME_OFFSET, Message.MESSAGE_OFFSET)
+        if uname_end < 0:
+            uname_end = Message.MESSAGE_OFFSET
+        msg_end = data.find(b"\x00", Message.MESSAGE_OFFSET)
+        if msg_end < 0:
+            msg_end = Message.MSG_SIZE
+        return msg_type, ts, data[Message.USERNAME_OFFSET:uname_end], data[Message.MESSAGE_OFFSET:msg_end]
 
     @staticmethod
     def unpack_message(data):
-        msg_type, ts, uname_bytes, msg_bytes = struct.unpack(Message.MSG_FMT, data)
-        username = uname_bytes.split(b"\x00", 1)[0].decode("utf-8", errors="ignore")
-        message = msg_bytes.split(b"\x00", 1)[0].decode("utf-8", errors="ignore")
+        msg_type, ts, uname_bytes, msg_bytes = Message.unpack_header(data)
+        username = uname_bytes.decode("utf-8", errors="ignore")
+        message = msg_bytes.decode("utf-8", errors="ignore")
         return Message(msg_type, username, message, ts)
 
 
-def send_all(sock, data):
+def remember_entry(entry: LogEntry, packed: bytes = None):
     """
-    Helper to ensure no short writes
+    Keep a log entry in memory, chat messages also go into the login history
+    packed is the entry's MESSAGE_RECV frame when the caller already has it (the live broadcast)
     """
-    view = memoryview(data)
-    while view:
-        n = sock.send(view)
-        if n == 0:
-            raise ConnectionError("socket closed")
-        view = view[n:]
+    LOG_ENTRIES.append(entry)
+    if entry.message_type == Message.MessageType.MSG_MESSAGE_SEND.value:
+        if packed is None:
+            # Pack once here so a login just concatenates frames
+            history_msg = Message(Message.MessageType.MSG_MESSAGE_RECV.value, entry.username, entry.message, entry.timestamp)
+            packed = history_msg.pack_message()
+        RECENT_SENDS.append((entry, packed))
 
 
-def recv_all(sock, n):
+def append_log(entry: LogEntry, packed: bytes = None):
     """
-    Helper to ensure no short reads
+    Remember a log entry and queue it for the log file
     """
-    buf = bytearray()
-    while len(buf) < n:
-        chunk = sock.recv(n - len(buf))
-        if not chunk:
-            raise ConnectionError("socket closed")
-        buf.extend(chunk)
-    return bytes(buf)
+    remember_entry(entry, packed)
+    LOG_QUEUE.put(entry)
 
 
-def append_log(entry: LogEntry):
+def log_writer():
     """
-    Append a log entry to the log entries list and write to the log file
+    Background thread that drains LOG_QUEUE into the log file
+    Keeps the file open and writes whatever has queued up (up to LOG_BATCH_SIZE entries) in one write.
+    Writes land in the file buffer, which is flushed and fsynced every LOG_SYNC_INTERVAL seconds and on stop.
+    I/O errors are logged and the thread keeps draining, so the queue never grows without bound
     """
-    with log_lock:
-        LOG_ENTRIES.append(entry)
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(entry.serialize() + "\n")
-        f.flush()
+    try:
+        f = open(LOG_FILE, "a", buffering=1 << 16, encoding="utf-8")
+    except OSError as e:
+        log.error("log_writer open(%s): %s, log entries will not be saved", LOG_FILE, e)
+        while LOG_QUEUE.get() is not None:
+            pass
+        return
+    try:
+        with f:
+            dirty = False
+            last_sync = time.monotonic()
+            while True:
+                try:
+                    batch = [LOG_QUEUE.get(timeout=LOG_SYNC_INTERVAL)]
+                except queue.Empty:
+                    batch = []  # idle, still sync below if something is pending
+                while batch and len(batch) < LOG_BATCH_SIZE:
+                    try:
+                        batch.append(LOG_QUEUE.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = None in batch
+                lines = [entry.serialize() for entry in batch if entry is not None]
+                if lines:
+                    try:
+                        # One join for the whole batch, no per line concatenation
+                        f.write("\n".join(lines) + "\n")
+                        dirty = True
+                    except OSError as e:
+                        log.error("log_writer write(%s): %s, dropped %s entries", LOG_FILE, e, len(lines))
+                if dirty and (stop or time.monotonic() - last_sync >= LOG_SYNC_INTERVAL):
+                    last_sync = time.monotonic()
+                    try:
+                        f.flush()
+                        os.fsync(f.fileno())
+                        dirty = False
+                    except OSError as e:
+                        # Stay dirty, the buffered lines are retried on the next sync
+                        log.error("log_writer sync(%s): %s", LOG_FILE, e)
+                if stop:
+                    return
+    except OSError as e:
+        # close() flushes one last time
+        log.error("log_writer close(%s): %s", LOG_FILE, e)
 
 
-def send_disconnect(sock, username, reason, ip):
+def send_disconnect(writer, username, reason, ip):
     """
     Send to the client a disconnect message with the reason
+    The message is queued on the transport and flushed when the writer is closed
     """
-    print(f"[ERROR] {ip}: {username} {reason}")
+    log.error("%s: %s %s", ip, username, reason)
     append_log(LogEntry(ip, Message.MessageType.MSG_DISCONNECT.value, username, reason))
     message = Message(Message.MessageType.MSG_DISCONNECT.value, username, reason)
     try:
-        send_all(sock, message.pack_message())
+        writer.write(message.pack_message())
     except Exception as e:
-        print(f"[ERROR] send_disconnect(sock, {username}, {reason}, {ip}): {e}")
+        log.error("send_disconnect(writer, %s, %s, %s): %s", username, reason, ip, e)
+
+
+def tune_client_socket(writer):
+    """
+    Disable Nagle so single frames go out immediately, and give the kernel room to absorb broadcast bursts
+    """
+    sock = writer.get_extra_info("socket")
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, CLIENT_SNDBUF)
+    except OSError as e:
+        log.error("tune_client_socket(writer): %s", e)
+
+
+def set_cork(writer, corked: bool):
+    """
+    Toggle TCP_CORK (Linux only) on a client connection
+    While corked the kernel only sends full segments, uncorking flushes whatever is left
+    """
+    sock = writer.get_extra_info("socket")
+    if sock is None or not hasattr(socket, "TCP_CORK"):
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, int(corked))
+    except OSError as e:
+        log.error("set_cork(writer, %s): %s", corked, e)
+
+
+class ClientState:
+    """
+    A logged in client, the values of the clients dict
+    """
+    writer: asyncio.StreamWriter
+    username: str
+    ip: str
+    last_seen: float  # time.monotonic() of the last message received
+    closed_by_server: bool  # the server already sent the reason and closed the connection
+
+    def __init__(self, writer: asyncio.StreamWriter, username: str, ip: str):
+        self.writer = writer
+        self.username = username
+        self.ip = ip
+        self.last_seen = time.monotonic()
+        self.closed_by_server = False
+
+
+def log_message(message_type: int, timestamp: int, username: str, message: str):
+    """
+    Log a broadcast message as a [MESSAGE] line
+    """
+    if log.isEnabledFor(MESSAGE):
+        log.log(MESSAGE, "%s\t%s\t%s: %s", message_type, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)), username, message)
+
+
+def broadcast_raw(packed):
+    """
+    Send an already packed frame to all clients that are connected
+    Never waits on a client: the frame is queued on each transport and flushed by the event loop
+    """
+    for writer, client in clients.items():
+        try:
+            if writer.transport.get_write_buffer_size() > MAX_CLIENT_BACKLOG:
+                # abort() drops the backlog, the client's handler notices and cleans up
+                log.error("broadcast_raw %s(%s) is not reading, dropping the connection", client.username, client.ip)
+                client.closed_by_server = True
+                writer.transport.abort()
+                continue
+            writer.write(packed)
+        except Exception as e:
+            log.error("broadcast_raw write(%s(%s)): %s", client.username, client.ip, e)
 
 
 def broadcast_message(message_type: int, username: str, message: str):
@@ -159,107 +339,95 @@ def broadcast_message(message_type: int, username: str, message: str):
     """
     try:
         message = Message(message_type, username, message)
-        print(f"[MESSAGE] {message_type}\t{datetime.datetime.fromtimestamp(message.timestamp)}\t{username}: {message.message}")
-        with clients_lock:
-            for sock, u, ip in clients:
-                try:
-                    send_all(sock, message.pack_message())
-                except Exception as e:
-                    print(f"[ERROR] broadcast_message send_all({message_type}, {username}, {message}, {ip}): {e}")
+        log_message(message_type, message.timestamp, username, message.message)
+        # Every client receives the identical frame, so pack it once
+        broadcast_raw(message.pack_message())
     except Exception as e:
-        print(f"[ERROR] broadcast_message({message_type}, {username}, {message}): {e}")
+        log.error("broadcast_message(%s, %s, %s): %s", message_type, username, message, e)
 
 
-def client_thread(sock, addr):
+async def handle(reader, writer):
     """
     Handle a client connection and all its recieved messages
     Three step procedure: 1) receive login, 2) send history messages, 3) continually listen for sends/logouts
     """
+    addr = writer.get_extra_info("peername")
     ip = addr[0]
     username = ""
-    message_times = []  # Track message times for rate limiting
+    message_times = collections.deque(maxlen=5)  # Times of the last 5 messages for rate limiting
+    log.info("Accepted connection from %s:%s", addr[0], addr[1])
+    tune_client_socket(writer)
     
     try:
         # 1) LOGIN
         # Can we receive the message?
-        print(f"[INFO] Waiting for LOGIN from {ip}")
+        log.info("Waiting for LOGIN from %s", ip)
         try:
-            # Set 5 second timeout for login message
-            sock.settimeout(5.0)
-            data = recv_all(sock, Message.MSG_SIZE)
-            # Reset timeout to None (blocking) after successful login receive
-            sock.settimeout(None)
+            # 5 second timeout for login message
+            data = await asyncio.wait_for(reader.readexactly(Message.MSG_SIZE), timeout=5)
+        except asyncio.CancelledError:
+            raise  # an Exception subclass before Python 3.8, let shutdown cancel the handler
         except Exception as e:
-            print(f"[ERROR] client_thread receive {e}")
-            send_disconnect(sock, "???", "Failed to receive LOGIN message within 5s", ip)
+            log.error("handle receive %s", e)
+            send_disconnect(writer, "???", "Failed to receive LOGIN message within 5s", ip)
             return
         
         # Can we parse the message?
         try:
-            msg = Message.unpack_message(data)
+            msg_type, _, raw_username, _ = Message.unpack_header(data)
         except Exception as e:
-            print(f"[ERROR] client_thread parse {e}")
-            send_disconnect(sock, "???", "Failed to parse LOGIN message", ip)
+            log.error("handle parse %s", e)
+            send_disconnect(writer, "???", "Failed to parse LOGIN message", ip)
             return
         
         # Is the message type LOGIN?
-        if msg.message_type != Message.MessageType.MSG_LOGIN.value:
-            send_disconnect(sock, "???", "First message must be LOGIN", ip)
+        if msg_type != Message.MessageType.MSG_LOGIN.value:
+            send_disconnect(writer, "???", "First message must be LOGIN", ip)
             return
         
         # Validate username
-        if not msg.username or not msg.username.strip():
-            send_disconnect(sock, "???", "Username must not be empty", ip)
+        if not raw_username.strip():
+            send_disconnect(writer, "???", "Username must not be empty", ip)
             return
         
-        # Is the username ASCII and alphanumeric?
-        if not is_ascii(msg.username) or not msg.username.isalnum():
-            send_disconnect(sock, "???", "Username must be alphanumeric and ASCII", ip)
+        # Is the username ASCII and alphanumeric? (bytes.isalnum only accepts ASCII letters and digits)
+        if not raw_username.isalnum():
+            send_disconnect(writer, "???", "Username must be alphanumeric and ASCII", ip)
             return
+        # Checked to be ASCII above, so this cannot fail
+        login_name = raw_username.decode("ascii")
 
         # Check if username is already connected
-        with clients_lock:
-            for _, u, _ in clients:
-                if u == msg.username:
-                    send_disconnect(sock, msg.username, "Username already connected", ip)
-                    return
+        for client in clients.values():
+            if client.username == login_name:
+                send_disconnect(writer, login_name, "Username already connected", ip)
+                return
     
         # check if the username is in the do not assign list
         dn_list = ["SYSTEM", "SERVER", "ADMIN", "ROOT"]
-        if msg.username in dn_list:
-            send_disconnect(sock, msg.username, "Username is reserved", ip)
+        if login_name in dn_list:
+            send_disconnect(writer, login_name, "Username is reserved", ip)
             return
-        username = msg.username
+        username = login_name
 
         # 2) HISTORY
-        print(f"[INFO] LOGIN succeeded for {username}({ip}). Sending history...")
+        log.info("LOGIN succeeded for %s(%s). Sending history...", username, ip)
+        # History, the login broadcast and the welcome go out back to back, cork so they share segments
+        set_cork(writer, True)
         try:
-            # Get the last 25 messages with MSG_MESSAGE_SEND type
-            with log_lock:
-                # Look for MESSAGE_SEND entries in the last 100 messages, chances are there are 25 message sends there
-                history_messages = [
-                    entry for entry in LOG_ENTRIES[-100:]
-                    if entry.message_type == Message.MessageType.MSG_MESSAGE_SEND.value
-                ][-25:]
-            
-            # Send each history entry as MSG_MESSAGE_RECV
-            for entry in history_messages:
-                print(entry.message)
-                history_msg = Message(
-                    Message.MessageType.MSG_MESSAGE_RECV.value,
-                    entry.username,
-                    entry.message,
-                    entry.timestamp
-                )
-                send_all(sock, history_msg.pack_message())
+            # Send the last 25 MSG_MESSAGE_SEND entries as MSG_MESSAGE_RECV in a single write
+            writer.write(b"".join(packed for _, packed in RECENT_SENDS))
+            await writer.drain()
+        except asyncio.CancelledError:
+            raise  # an Exception subclass before Python 3.8, let shutdown cancel the handler
         except Exception as e:
-            print(f"[ERROR] client_thread history {e}")
+            log.error("handle history %s", e)
 
-        print(f"[INFO] History sent for {username}({ip}). Adding client to the broadcast list")
-        # 3) join the clients list and broadcast the login
-        with clients_lock:
-            clients.append((sock, username, ip))
-            num_connected = len(clients)
+        log.info("History sent for %s(%s). Adding client to the broadcast list", username, ip)
+        # 3) join the clients and broadcast the login
+        client = ClientState(writer, username, ip)
+        clients[writer] = client
+        num_connected = len(clients)
         append_log(LogEntry(ip, Message.MessageType.MSG_LOGIN.value, username, f"{username} logged in"))
         broadcast_message(Message.MessageType.MSG_SYSTEM.value, "SYSTEM", f"{username} logged in")
         
@@ -267,148 +435,230 @@ def client_thread(sock, addr):
         welcome_msg = Message(Message.MessageType.MSG_SYSTEM.value, "SYSTEM", 
                              f"Welcome! There are {num_connected} user(s) connected. Type !help for commands.")
         try:
-            send_all(sock, welcome_msg.pack_message())
+            writer.write(welcome_msg.pack_message())
+            await writer.drain()
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"[ERROR] Failed to send welcome message to {username}({ip}): {e}")
-
-        # Set 30 minute timeout for message receiving
-        TIMEOUT_SECONDS = 15 * 60  # 15 minutes
-        sock.settimeout(TIMEOUT_SECONDS)
+            log.error("Failed to send welcome message to %s(%s): %s", username, ip, e)
+        set_cork(writer, False)
 
         # 4) Main loop
+        # No per read timeout here, disconnect_idle_clients() handles idle clients for everyone at once
         while True:
-            print(f"[INFO] Waiting for LOGOUT/MSGRECV from client")
+            log.debug("Waiting for LOGOUT/MSGRECV from %s(%s)", username, ip)
             # Can we receive a message?
             try:
-                data = recv_all(sock, Message.MSG_SIZE)
-            except socket.timeout:
-                print(f"[ERROR] client_thread timeout: Client {username}({ip}) did not send a message within {TIMEOUT_SECONDS} seconds")
-                send_disconnect(sock, username, f"Disconnected due to timeout (no message received in {TIMEOUT_SECONDS // 60} minutes)", ip)
-                break
+                data = await reader.readexactly(Message.MSG_SIZE)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                print(f"[ERROR] client_thread receive message {e}")
-                send_disconnect(sock, username, "Failed to receive message", ip)
+                if client.closed_by_server:
+                    break
+                log.error("handle receive message %s", e)
+                send_disconnect(writer, username, "Failed to receive message", ip)
                 break
+            client.last_seen = time.monotonic()
             
             # Can we parse the message?
             try:
-                msg = Message.unpack_message(data)
+                msg_type, _, _, raw_message = Message.unpack_header(data)
             except Exception as e:
-                print(f"[ERROR] client_thread parse message {e}")
-                send_disconnect(sock, username, "Failed to parse message", ip)
+                log.error("handle parse message %s", e)
+                send_disconnect(writer, username, "Failed to parse message", ip)
                 break
             
             # Is this a LOGOUT message?
-            if msg.message_type == Message.MessageType.MSG_LOGOUT.value:
-                print(f"[INFO] Client sent logout.")
+            if msg_type == Message.MessageType.MSG_LOGOUT.value:
+                log.info("Client sent logout.")
                 append_log(LogEntry(ip, Message.MessageType.MSG_LOGOUT.value, username, f"{username} logged out"))
                 break
             
             # Is this a MESSAGE_SEND message?
-            elif msg.message_type == Message.MessageType.MSG_MESSAGE_SEND.value:
-                print(f"[INFO] Client sent a message")
-                # Rate limiting: check if >5 messages in last second
+            elif msg_type == Message.MessageType.MSG_MESSAGE_SEND.value:
+                log.debug("%s(%s) sent a message", username, ip)
+                # Rate limiting: check if >5 messages in last second, i.e. the 5th most recent one is under a second old
                 current_time = time.time()
-                message_times = [t for t in message_times if current_time - t < 1.0]
-                if len(message_times) >= 5:
-                    print(f"[INFO] Client is spamming. Disconnecting client.")
-                    send_disconnect(sock, username, "Too many messages at once (>5 in a second)", ip)
+                timestamp = int(current_time)
+                if len(message_times) == message_times.maxlen and current_time - message_times[0] < 1.0:
+                    log.info("Client is spamming. Disconnecting client.")
+                    send_disconnect(writer, username, "Too many messages at once (>5 in a second)", ip)
                     break
                 message_times.append(current_time)
                 
                 # Check message validity
-                if not msg.message:
-                    send_disconnect(sock, username, "Messages must not be empty", ip)
+                if not raw_message:
+                    send_disconnect(writer, username, "Messages must not be empty", ip)
                     break
                 
-                if "\n" in msg.message:
-                    send_disconnect(sock, username, "Messages must not contain newlines", ip)
+                if b"\n" in raw_message:
+                    send_disconnect(writer, username, "Messages must not contain newlines", ip)
                     break
                 
-                if not is_ascii(msg.message) or not msg.message.isprintable():
-                    send_disconnect(sock, username, "Messages must be ASCII", ip)
+                if not is_printable_ascii(raw_message):
+                    send_disconnect(writer, username, "Messages must be ASCII", ip)
                     break
+                # Checked to be printable ASCII above, so this cannot fail
+                message = raw_message.decode("ascii")
                 
+                # Pack the validated bytes directly, no Message and no decode/encode round trip.
+                # Truncating like pack_message keeps both fields null terminated, and nothing the
+                # client sent after its terminator is passed on.
+                # The same frame is the history entry and, unless this is a command, the broadcast
+                frame = Message.MSG_STRUCT.pack(
+                    Message.MessageType.MSG_MESSAGE_RECV.value,
+                    timestamp,
+                    raw_username[:Message.USERNAME_LEN-1],
+                    raw_message[:Message.MESSAGE_LEN-1]
+                )
+
                 # Log the message
-                append_log(LogEntry(ip, Message.MessageType.MSG_MESSAGE_SEND.value, username, msg.message))
+                append_log(LogEntry(ip, Message.MessageType.MSG_MESSAGE_SEND.value, username, message, timestamp), frame)
 
                 # Check if the message is a command
-                if msg.message == "!help":
-                    send_all(sock, Message(Message.MessageType.MSG_SYSTEM.value, "SYSTEM", "Commands: !help, !list, !disconnect").pack_message())
+                if raw_message == b"!help":
+                    writer.write(Message(Message.MessageType.MSG_SYSTEM.value, "SYSTEM", "Commands: !help, !list, !disconnect").pack_message())
+                    await writer.drain()
                     continue
-                elif msg.message == "!list":
-                    with clients_lock:
-                        user_list = [u for _, u, _ in clients]
-                        user_list_str = ", ".join(user_list)
-                        num_connected = len(clients)
-                        message = f"There are {num_connected} user(s) connected: {user_list_str}"
-                    send_all(sock, Message(Message.MessageType.MSG_SYSTEM.value, "SYSTEM", message).pack_message())
+                elif raw_message == b"!list":
+                    user_list_str = ", ".join(c.username for c in clients.values())
+                    num_connected = len(clients)
+                    reply = f"There are {num_connected} user(s) connected: {user_list_str}"
+                    writer.write(Message(Message.MessageType.MSG_SYSTEM.value, "SYSTEM", reply).pack_message())
+                    await writer.drain()
                     continue
-                elif msg.message == "!disconnect":
-                    send_disconnect(sock, username, "User asked to be disconnected", ip)
+                elif raw_message == b"!disconnect":
+                    send_disconnect(writer, username, "User asked to be disconnected", ip)
                     break
                 
                 # If it wasn't a command, broadcast the message to everyone
-                print(f"[INFO] Broadcasting client message to everyone")
-                broadcast_message(Message.MessageType.MSG_MESSAGE_RECV.value, username, msg.message)
+                log.debug("Broadcasting %s's message to everyone", username)
+                log_message(Message.MessageType.MSG_MESSAGE_RECV.value, timestamp, username, message)
+                broadcast_raw(frame)
 
             else:
-                send_disconnect(sock, username, "Message type not supported", ip)
+                send_disconnect(writer, username, "Message type not supported", ip)
                 break
 
     except ConnectionError:
-        print(f"[INFO] Client {ip} disconnected")
+        log.info("Client %s disconnected", ip)
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        print(f"[ERROR] client_thread({ip}): {e}")
-        send_disconnect(sock, username, f"You caused a server error", ip)
+        log.error("handle(%s): %s", ip, e)
+        send_disconnect(writer, username, f"You caused a server error", ip)
     finally:
-        with clients_lock:
-            for i, (s, u, ip2) in enumerate(clients):
-                if s is sock:
-                    clients.pop(i)
-                    break
+        clients.pop(writer, None)
         try:
-            sock.close()
+            writer.close()
         except Exception as e:
-            print(f"[ERROR] client_thread finally {e}")
-        if username:
+            log.error("handle finally %s", e)
+        # On shutdown every client is being disconnected anyway
+        if username and running:
             broadcast_message(Message.MessageType.MSG_SYSTEM.value, "SYSTEM", f"{username} has disconnected")
 
 
-def signal_handler(signum, frame):
+async def disconnect_idle_clients():
+    """
+    Disconnect clients that have not sent a message in CLIENT_TIMEOUT seconds
+    One periodic sweep is far cheaper than arming a timeout around every read
+    """
+    while True:
+        await asyncio.sleep(IDLE_CHECK_INTERVAL)
+        now = time.monotonic()
+        for writer, client in clients.items():
+            # One bad client must not end the sweep, it is the only idle timeout there is
+            try:
+                if not client.closed_by_server and now - client.last_seen > CLIENT_TIMEOUT:
+                    log.error("Client %s(%s) did not send a message within %s seconds", client.username, client.ip, CLIENT_TIMEOUT)
+                    send_disconnect(writer, client.username, f"Disconnected due to timeout (no message received in {CLIENT_TIMEOUT // 60} minutes)", client.ip)
+                    client.closed_by_server = True
+                    # Flushes the disconnect, then the handler's read fails and it cleans up
+                    writer.close()
+            except Exception as e:
+                log.error("disconnect_idle_clients(%s(%s)): %s", client.username, client.ip, e)
+
+
+def accept_client(reader, writer):
     """
-    Handle SIGINT and SIGTERM signals by closing the server socket.
-    This causes srv.accept() to raise an exception, allowing the finally block to execute.
+    Start a handler task for a newly accepted connection and keep track of it for shutdown
     """
-    global server_socket, running
+    task = asyncio.ensure_future(handle(reader, writer))
+    client_tasks.add(task)
+    task.add_done_callback(client_tasks.discard)
+
+
+def signal_handler(signum, stop_event):
+    """
+    Handle SIGINT and SIGTERM signals by waking up serve(), which then closes the server.
+    Runs on the event loop (registered with loop.add_signal_handler), so it is safe to touch loop state here.
+    """
+    global running
     signal_name = signal.Signals(signum).name
-    print(f"[INFO] Received {signal_name}, shutting down...")
+    log.info("Received %s, shutting down...", signal_name)
     running = False
-    if server_socket:
-        try:
-            server_socket.close()
-        except Exception as e:
-            print(f"[ERROR] Error closing server socket in signal handler: {e}")
+    stop_event.set()
 
 
-def main():
-    import sys
-    global running, server_socket
+async def serve(port):
+    """
+    Run the server until SIGINT/SIGTERM, then disconnect every client
+    """
+    global running
+    loop = asyncio.get_event_loop()
+    stop_event = asyncio.Event()
 
     # Register signal handlers for graceful shutdown
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    loop.add_signal_handler(signal.SIGINT, signal_handler, signal.SIGINT, stop_event)
+    loop.add_signal_handler(signal.SIGTERM, signal_handler, signal.SIGTERM, stop_event)
+
+    # Deliberately one listener in one process: clients and history live in this process only,
+    # so SO_REUSEPORT worker processes would split the chat into rooms that cannot see each other.
+    # The event loop already accepts up to backlog connections per wakeup.
+    server = await asyncio.start_server(accept_client, "0.0.0.0", port, backlog=300)
+    log.info("mycord server listening on 0.0.0.0:%s", port)
+    idle_task = asyncio.ensure_future(disconnect_idle_clients())
 
-    # give the students a random port that is based on their username to avoid possible conflicts
+    try:
+        await stop_event.wait()
+    finally:
+        running = False
+        log.info("Closing server...")
+        idle_task.cancel()
+        server.close()
+        log.info("Sending disconnect messages and closing connections...")
+        for writer, client in clients.items():
+            try:
+                send_disconnect(writer, client.username, "Server is shutting down", client.ip)
+            finally:
+                # Always close the connection after attempting to send disconnect, close() flushes what is buffered
+                try:
+                    writer.close()
+                except Exception as e:
+                    log.error("Failed to close connection for %s(%s): %s", client.username, client.ip, e)
+        clients.clear()
+        for task in client_tasks:
+            task.cancel()
+        if client_tasks:
+            await asyncio.wait(list(client_tasks))
+        await server.wait_closed()
+        log.info("Bye!")
+
+
+def main():
+    setup_logging()
+
+    # give the students a port that is based on their username to avoid possible conflicts
+    # crc32 rather than hash() so the port stays the same across runs (hash() of a str is randomized per process)
     # they can specify with argv[1] an alternative port number if they want to
-    port = hash(os.environ["USER"]) % (65535 - 2000) + 2000
+    port = zlib.crc32(os.environ["USER"].encode("utf-8")) % (65535 - 2000) + 2000
     if len(sys.argv) >= 2:
         port = int(sys.argv[1])
 
-    print("[INFO] Loading history")
+    log.info("Loading history")
     try:
         if not os.path.exists(LOG_FILE):
-            print("[INFO] Creating new log file")
+            log.info("Creating new log file")
             amount = 30
             with open(LOG_FILE, "w"):
                 random_usernames = ["abc123", "def456", "ghi789"]
@@ -430,58 +680,30 @@ def main():
                     line = line.strip()
                     if line:
                         try:
-                            LOG_ENTRIES.append(LogEntry.deserialize(line))
+                            remember_entry(LogEntry.deserialize(line))
                             amount += 1
                         except Exception as e:
-                            print(f"[WARNING] Failed to load log entry: {e}")
+                            log.warning("Failed to load log entry: %s", e)
                             continue
     except Exception as e:
-            print(f"[ERROR] Failed to load history: {e}")
+            log.error("Failed to load history: %s", e)
             return
-    print(f"[INFO] Parsed {amount} messages from the history file")
+    log.info("Parsed %s messages from the history file", amount)
 
-    # start the server
-    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    srv.bind(("0.0.0.0", port))
-    srv.listen(300)
-    server_socket = srv  # Store in global for signal handlers
-    print(f"[INFO] mycord server listening on 0.0.0.0:{port}")
+    # file writes happen off the event loop
+    log_thread = threading.Thread(target=log_writer, daemon=True)
+    log_thread.start()
 
+    # start the server, a single event loop thread serves every client
+    loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
     try:
-        while running:
-            sock, addr = srv.accept()
-            print(f"[INFO] Accepted connection from {addr[0]}:{addr[1]}")
-            th = threading.Thread(target=client_thread, args=(sock, addr), daemon=True)
-            th.start()
-    except KeyboardInterrupt:
-        print("[INFO] KeyboardInterrupt, shutting down...")
-    except OSError:
-        # Socket closed by signal handler or other means
-        if running:
-            raise  # Re-raise if it wasn't intentional
-        print("[INFO] Server socket closed, shutting down...")
+        loop.run_until_complete(serve(port))
     finally:
-        running = False
-        print("[INFO] Closing server...")
-        srv.close()
-        print("[INFO] Sending disconnect messages and closing connections...")
-        with clients_lock:
-            for sock, u, ip in clients:
-                try:
-                    # Set 1 second timeout for disconnect send in case socket is dead
-                    sock.settimeout(1.0)
-                    send_disconnect(sock, u, "Server is shutting down", ip)
-                except Exception as e:
-                    print(f"[ERROR] Failed to send disconnect to {u}({ip}): {e}")
-                finally:
-                    # Always close the socket after attempting to send disconnect
-                    try:
-                        sock.close()
-                    except Exception as e:
-                        print(f"[ERROR] Failed to close socket for {u}({ip}): {e}")
-            clients.clear()
-        print("[INFO] Bye!")
+        loop.close()
+        # write out whatever is still queued
+        LOG_QUEUE.put(None)
+        log_thread.join()
 
 
 if __name__ == "__main__":